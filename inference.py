@@ -1,41 +1,77 @@
 # inference.py
 import os
 import time
-import subprocess
+import asyncio
+import importlib
+import multiprocessing
 from datetime import datetime
 from dotenv import load_dotenv
-from human_eval.data import write_jsonl, read_problems
+from human_eval.data import read_problems
+from human_eval.evaluation import evaluate_functional_correctness
 from tqdm import tqdm
 from results_tracker import ResultsTracker
+from jsonl_utils import write_jsonl, dumps_line
+from scripts.fanout import ERROR_COMPLETION
+from scripts.llm_clients import run_sync
 
 # Load environment first
 load_dotenv()
 
-# Conditional import based on agent framework setting
-USE_CREWAI = os.getenv("USE_CREWAI", "false").lower() == "true"
-USE_QWEN_AGENT = os.getenv("USE_QWEN_AGENT", "false").lower() == "true"
-USE_LANGCHAIN = os.getenv("USE_LANGCHAIN", "false").lower() == "true"
-USE_LANGGRAPH = os.getenv("USE_LANGGRAPH", "false").lower() == "true"
-USE_OPENAI_AGENT = os.getenv("USE_OPENAI_AGENT", "false").lower() == "true"
-
-if USE_OPENAI_AGENT:
-    print("🤖 Using OpenAI Agents SDK with OpenAI model for code generation")
-    from scripts.openai_agent import generate_one_completion
-elif USE_LANGGRAPH:
-    print("🤖 Using LangGraph framework with OpenAI model for code generation")
-    from scripts.langgraph_agent import generate_one_completion
-elif USE_LANGCHAIN:
-    print("🤖 Using LangChain Agent Executor with OpenAI model for code generation")
-    from scripts.langchain_agent import generate_one_completion
-elif USE_QWEN_AGENT:
-    print("🤖 Using Qwen-Agent framework with OpenAI model for code generation")
-    from scripts.qwen_agent import generate_one_completion
-elif USE_CREWAI:
-    print("🤖 Using CrewAI Agent for code generation")
-    from scripts.crewai_agent import generate_one_completion
-else:
-    print("🔧 Using OpenAI API directly for code generation")
-    from scripts.openAI_models import generate_one_completion
+def _env_flag(name: str) -> bool:
+    return os.getenv(name, "false").casefold() == "true"
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+# Configuration is read once at import; nothing below calls os.getenv again.
+# Agent framework flags, in precedence order (first enabled wins)
+_USE = {
+    "openai_agent": _env_flag("USE_OPENAI_AGENT"),
+    "langgraph": _env_flag("USE_LANGGRAPH"),
+    "langchain": _env_flag("USE_LANGCHAIN"),
+    "qwen_agent": _env_flag("USE_QWEN_AGENT"),
+    "crewai": _env_flag("USE_CREWAI"),
+}
+_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
+_NUM_SAMPLES = _env_int("NUM_SAMPLES_PER_TASK", 10)
+_MAX_CONCURRENCY = max(1, _env_int("MAX_CONCURRENCY", 16))
+_PROMPT_BINS = max(1, _env_int("PROMPT_BINS", 3))
+_EVAL_WORKERS = max(1, _env_int("EVAL_WORKERS", os.cpu_count() or 4))
+_BATCH_MODE = _env_flag("BATCH_MODE")
+_BATCH_POLL_INTERVAL = max(1, _env_int("BATCH_POLL_INTERVAL", 60))
+
+# Task selection
+_SHUFFLE_TASKS = _env_flag("SHUFFLE_TASKS")
+_TASK_SHUFFLE_SEED = os.getenv("TASK_SHUFFLE_SEED")
+_TASK_IDS = os.getenv("TASK_IDS")
+_TASK_LIMIT = os.getenv("TASK_LIMIT")
+
+# Agent backends: name -> (module, approach name for results CSV, startup banner)
+BACKENDS = {
+    "openai_agent": ("scripts.openai_agent", "OpenAI Agent", "🤖 Using OpenAI Agents SDK with OpenAI model for code generation"),
+    "langgraph": ("scripts.langgraph_agent", "LangGraph Agent", "🤖 Using LangGraph framework with OpenAI model for code generation"),
+    "langchain": ("scripts.langchain_agent", "LangChain Agent", "🤖 Using LangChain Agent Executor with OpenAI model for code generation"),
+    "qwen_agent": ("scripts.qwen_agent", "Qwen-Agent", "🤖 Using Qwen-Agent framework with OpenAI model for code generation"),
+    "crewai": ("scripts.crewai_agent", "CrewAI Agent", "🤖 Using CrewAI Agent for code generation"),
+    "direct": ("scripts.openAI_models", "OpenAI Direct", "🔧 Using OpenAI API directly for code generation"),
+}
+
+# First enabled flag wins; fall back to the direct API
+AGENT_TYPE = next((name for name, enabled in _USE.items() if enabled), "direct")
+_backend_module, APPROACH_NAME, _backend_banner = BACKENDS[AGENT_TYPE]
+print(_backend_banner)
+
+# Import only the selected backend, once
+backend = importlib.import_module(_backend_module)
+generate_one_completion = backend.generate_one_completion
+agenerate_one_completion = backend.agenerate_one_completion
+# Optional: backends that can return several samples from one request
+agenerate_n_completions = getattr(backend, "agenerate_n_completions", None)
+reset_token_usage = backend.reset_token_usage
+get_token_usage = backend.get_token_usage
 
 def _select_task_ids(all_task_ids):
     """
@@ -49,33 +85,153 @@ def _select_task_ids(all_task_ids):
     task_ids = list(all_task_ids)
 
     # optional shuffle
-    if os.getenv("SHUFFLE_TASKS", "false").lower() == "true":
-        random.seed(os.getenv("TASK_SHUFFLE_SEED"))  # optional
+    if _SHUFFLE_TASKS:
+        random.seed(_TASK_SHUFFLE_SEED)  # optional
         random.shuffle(task_ids)
 
-    explicit = os.getenv("TASK_IDS")
-    if explicit:
-        wanted = {tid.strip() for tid in explicit.split(",") if tid.strip()}
+    if _TASK_IDS:
+        wanted = {tid.strip() for tid in _TASK_IDS.split(",") if tid.strip()}
         return [tid for tid in task_ids if tid in wanted]
 
-    limit = os.getenv("TASK_LIMIT")
-    if limit and limit.isdigit():
-        return task_ids[: int(limit)]
+    if _TASK_LIMIT and _TASK_LIMIT.isdigit():
+        return task_ids[: int(_TASK_LIMIT)]
 
     return task_ids
 
+def _bin_by_prompt_length(problems, task_ids, num_bins):
+    """
+    Group task ids into at most num_bins bins of similar prompt length
+    (shortest first). Prompt length is a cheap proxy for output length, so
+    requests within a bin finish at similar times and slots are not held
+    idle behind a few long generations.
+    """
+    ordered = sorted(task_ids, key=lambda task_id: len(problems[task_id]["prompt"]))
+    bin_size = max(1, -(-len(ordered) // max(1, num_bins)))
+    return [ordered[i:i + bin_size] for i in range(0, len(ordered), bin_size)]
+
+async def _generate_samples(problems, task_ids, num_samples_per_task, max_concurrency, num_bins, samples_file):
+    """
+    Fan out every (task, sample) completion onto the event loop.
+    Concurrency is bounded by a semaphore (MAX_CONCURRENCY) to respect rate limits.
+    Backends exposing agenerate_n_completions get one request per task instead.
+    Tasks are binned by prompt length (PROMPT_BINS) and bins run one after another.
+    Each completion is written to samples_file as soon as it finishes, so memory
+    stays flat and partial results survive a crash. Returns the number written.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    # A request that raises gets the error fallback body, as in gather_completions,
+    # so one failure does not abort the run and discard the requests in flight
+    async def run_one(task_id, sample_num):
+        async with semaphore:
+            try:
+                completion = await agenerate_one_completion(
+                    problems[task_id]["prompt"], sample_num=sample_num
+                )
+            except Exception as e:
+                print(f"❌ Generation error ({task_id}): {e}")
+                completion = ERROR_COMPLETION
+        return task_id, [completion]
+
+    async def run_task(task_id):
+        async with semaphore:
+            try:
+                completions = await agenerate_n_completions(
+                    problems[task_id]["prompt"], num_samples_per_task
+                )
+            except Exception as e:
+                print(f"❌ Generation error ({task_id}): {e}")
+                completions = [ERROR_COMPLETION] * num_samples_per_task
+        return task_id, completions
+
+    def make_jobs(bin_task_ids):
+        if agenerate_n_completions is not None:
+            # One request per task returns all of its samples
+            return [run_task(task_id) for task_id in bin_task_ids]
+        return [
+            run_one(task_id, sample_num)
+            for task_id in bin_task_ids
+            for sample_num in range(num_samples_per_task)
+        ]
+
+    written = 0
+
+    # Redraws are throttled: postfix changes never force a refresh and
+    # update() redraws at most every mininterval seconds
+    with tqdm(total=len(task_ids) * num_samples_per_task, desc="Progress", unit="completion",
+              mininterval=0.5) as pbar:
+        for bin_task_ids in _bin_by_prompt_length(problems, task_ids, num_bins):
+            for next_done in asyncio.as_completed(make_jobs(bin_task_ids)):
+                task_id, completions = await next_done
+                for completion in completions:
+                    samples_file.write(dumps_line({
+                        "task_id": task_id,
+                        "completion": completion,
+                    }))
+                written += len(completions)
+                pbar.set_postfix({"task": task_id}, refresh=False)
+                pbar.update(len(completions))
+
+    return written
+
+def _generate_samples_batch(problems, task_ids, num_samples_per_task, samples_file):
+    """
+    Generate every sample through the OpenAI Batch API (BATCH_MODE=true, direct mode).
+    Results are written to samples_file as they are downloaded; tasks whose request
+    failed get placeholder samples so the evaluator still sees every task.
+    Returns the number of samples written.
+    """
+    from scripts import openai_batch
+
+    requests = openai_batch.build_requests(problems, task_ids, num_samples_per_task)
+    batch_id = openai_batch.create_batch(requests)
+    print(f"✓ Submitted batch {batch_id} ({len(requests)} requests), polling every {_BATCH_POLL_INTERVAL}s")
+    batch = openai_batch.poll_batch(batch_id, _BATCH_POLL_INTERVAL)
+    print(f"✓ Batch finished with status: {batch.status}")
+
+    counts = dict.fromkeys(task_ids, 0)
+    for task_id, completions in openai_batch.fetch_results(batch):
+        for completion in completions[:num_samples_per_task]:
+            samples_file.write(dumps_line({"task_id": task_id, "completion": completion}))
+        counts[task_id] += min(len(completions), num_samples_per_task)
+
+    failed = [task_id for task_id, count in counts.items() if count < num_samples_per_task]
+    if failed:
+        print(f"❌ {len(failed)} tasks missing from batch output; writing placeholder samples")
+    for task_id in failed:
+        for _ in range(num_samples_per_task - counts[task_id]):
+            samples_file.write(dumps_line({
+                "task_id": task_id,
+                "completion": ERROR_COMPLETION,
+            }))
+
+    return len(task_ids) * num_samples_per_task
+
 def main():
     # Environment already loaded at module level
     
-    # Start timing
-    start_time = time.time()
+    # Start timing: one monotonic clock for durations, one wall-clock stamp for the run
+    start_time = time.monotonic()
+    run_started = datetime.now()
 
-    # Get configuration
-    model_name = os.getenv("OPENAI_MODEL", "gpt-4o")
-    try:
-        num_samples_per_task = int(os.getenv("NUM_SAMPLES_PER_TASK", "10"))
-    except ValueError:
-        num_samples_per_task = 10
+    # Get configuration (read once at import)
+    model_name = _MODEL
+    num_samples_per_task = _NUM_SAMPLES
+    max_concurrency = _MAX_CONCURRENCY
+    num_bins = _PROMPT_BINS
+    eval_workers = _EVAL_WORKERS
+    use_batch = _BATCH_MODE and AGENT_TYPE == "direct"
+    if _BATCH_MODE and not use_batch:
+        print("⚠️  BATCH_MODE is only supported with the direct OpenAI API; ignoring it")
+    # One n= request per task pays for one prompt instead of one per sample;
+    # label the row so it is not compared as-is with per-sample frameworks
+    use_n_sampling = agenerate_n_completions is not None and num_samples_per_task > 1
+    if use_batch:
+        approach_name = f"{APPROACH_NAME} (Batch)"
+    elif use_n_sampling:
+        approach_name = f"{APPROACH_NAME} (n=)"
+    else:
+        approach_name = APPROACH_NAME
 
     # Create folder structure
     output_base = "outputs"
@@ -86,21 +242,10 @@ def main():
         os.makedirs(directory, exist_ok=True)
 
     # Generate timestamp for filenames
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    timestamp = run_started.strftime("%Y%m%d_%H%M%S")
     
     # Add agent type to filename for easy differentiation
-    if USE_OPENAI_AGENT:
-        agent_type = "openai_agent"
-    elif USE_LANGGRAPH:
-        agent_type = "langgraph"
-    elif USE_LANGCHAIN:
-        agent_type = "langchain"
-    elif USE_QWEN_AGENT:
-        agent_type = "qwen_agent"
-    elif USE_CREWAI:
-        agent_type = "crewai"
-    else:
-        agent_type = "direct"
+    agent_type = AGENT_TYPE
     base_filename = f"{agent_type}_{model_name.replace('/', '_')}_{timestamp}"
 
     print(f"\n{'='*60}")
@@ -108,6 +253,12 @@ def main():
     print(f"{'='*60}")
     print(f"Model: {model_name}")
     print(f"Samples per task: {num_samples_per_task}")
+    if use_batch:
+        print("Mode: OpenAI Batch API")
+    else:
+        print(f"Max concurrency: {max_concurrency}")
+        if use_n_sampling:
+            print("Mode: one n= request per task")
     print(f"Timestamp: {timestamp}")
     print(f"{'='*60}\n")
 
@@ -118,108 +269,66 @@ def main():
     print(f"✓ Selected {len(task_ids)} tasks from {len(problems)} total problems\n")
 
     # Reset token usage before generation
-    if USE_QWEN_AGENT:
-        from scripts.qwen_agent import reset_token_usage
-        reset_token_usage()
-    elif USE_CREWAI:
-        from scripts.crewai_agent import reset_token_usage
-        reset_token_usage()
-    else:
-        from scripts.openAI_models import reset_token_usage
-        reset_token_usage()
+    reset_token_usage()
+
+    # Create custom problems file for evaluation before generation starts
+    # (streamed from a generator so no merged copy of the problem set is held)
+    custom_problems_path = os.path.join(problems_dir, f"{base_filename}.jsonl")
+    write_jsonl(custom_problems_path, (
+        {"task_id": task_id, **problems[task_id]}
+        for task_id in task_ids
+    ))
+    print(f"✓ Saved {len(task_ids)} problems to:")
+    print(f"  {custom_problems_path}\n")
 
-    # Generate completions with progress bar
+    # Generate completions with progress bar, streaming each sample to disk
     print("Generating completions...")
-    samples = []
-    total_generations = len(task_ids) * num_samples_per_task
-    
-    with tqdm(total=total_generations, desc="Progress", unit="completion") as pbar:
-        for task_id in task_ids:
-            prompt = problems[task_id]["prompt"]
-            for sample_num in range(num_samples_per_task):
-                pbar.set_postfix({"task": task_id, "sample": f"{sample_num+1}/{num_samples_per_task}"})
-                completion = generate_one_completion(prompt)
-                samples.append({
-                    "task_id": task_id,
-                    "completion": completion,
-                })
-                pbar.update(1)
-
-    # Write samples
     samples_path = os.path.join(samples_dir, f"{base_filename}.jsonl")
-    write_jsonl(samples_path, samples)
-    print(f"\n✓ Saved {len(samples)} completions to:")
+    with open(samples_path, "wb", buffering=1 << 20) as samples_file:
+        if use_batch:
+            num_written = _generate_samples_batch(problems, task_ids, num_samples_per_task, samples_file)
+        else:
+            num_written = run_sync(
+                _generate_samples(problems, task_ids, num_samples_per_task, max_concurrency, num_bins, samples_file)
+            )
+    print(f"\n✓ Saved {num_written} completions to:")
     print(f"  {samples_path}")
 
-    # Create custom problems file for evaluation
-    custom_problems = [
-        {"task_id": task_id, **problems[task_id]}
-        for task_id in task_ids
-    ]
-    custom_problems_path = os.path.join(problems_dir, f"{base_filename}.jsonl")
-    write_jsonl(custom_problems_path, custom_problems)
-    print(f"\n✓ Saved {len(custom_problems)} problems to:")
-    print(f"  {custom_problems_path}")
-
     # Run evaluation automatically
     print(f"\n{'='*60}")
     print("Running Evaluation...")
     print(f"{'='*60}")
     
-    eval_start_time = time.time()
     results_path = os.path.join(results_dir, f"{base_filename}_results.jsonl")
     
     try:
-        # Run evaluation
-        eval_cmd = [
-            "python", "human-eval/human_eval/evaluate_functional_correctness.py",
-            samples_path, "--problem_file", custom_problems_path
-        ]
+        # human_eval runs every test in its own multiprocessing.Process. Forked
+        # children inherit the loaded interpreter instead of re-importing it
+        # (spawn/forkserver); macOS keeps its default because fork is unsafe there.
+        if "fork" in multiprocessing.get_all_start_methods() and os.uname().sysname != "Darwin":
+            multiprocessing.set_start_method("fork", force=True)
         
-        result = subprocess.run(eval_cmd, capture_output=True, text=True)
+        # Run evaluation in-process (no interpreter spawn or output buffering).
+        # Each test already runs in its own process; n_workers sets how many run at once.
+        evaluate_functional_correctness(
+            samples_path, n_workers=eval_workers, problem_file=custom_problems_path
+        )
         
-        if result.returncode == 0:
-            # Move results to proper location
-            temp_results = f"{samples_path}_results.jsonl"
-            if os.path.exists(temp_results):
-                os.rename(temp_results, results_path)
-                print(f"✓ Evaluation completed successfully!")
-                print(f"✓ Results saved to: {results_path}")
-                
-                # Calculate total execution time
-                total_time = time.time() - start_time
-                eval_time = time.time() - eval_start_time
-                
-                # Get token usage
-                if USE_OPENAI_AGENT:
-                    from scripts.openai_agent import get_token_usage
-                elif USE_LANGGRAPH:
-                    from scripts.langgraph_agent import get_token_usage
-                elif USE_LANGCHAIN:
-                    from scripts.langchain_agent import get_token_usage
-                elif USE_QWEN_AGENT:
-                    from scripts.qwen_agent import get_token_usage
-                elif USE_CREWAI:
-                    from scripts.crewai_agent import get_token_usage
-                else:
-                    from scripts.openAI_models import get_token_usage
-                
-                token_stats = get_token_usage()
-                
-                # Save to combined results CSV
-                tracker = ResultsTracker()
-                if USE_OPENAI_AGENT:
-                    approach_name = "OpenAI Agent"
-                elif USE_LANGGRAPH:
-                    approach_name = "LangGraph Agent"
-                elif USE_LANGCHAIN:
-                    approach_name = "LangChain Agent"
-                elif USE_QWEN_AGENT:
-                    approach_name = "Qwen-Agent"
-                elif USE_CREWAI:
-                    approach_name = "CrewAI Agent"
-                else:
-                    approach_name = "OpenAI Direct"
+        # Move results to proper location
+        temp_results = f"{samples_path}_results.jsonl"
+        if os.path.exists(temp_results):
+            os.rename(temp_results, results_path)
+            print(f"✓ Evaluation completed successfully!")
+            print(f"✓ Results saved to: {results_path}")
+            
+            # Calculate total execution time
+            total_time = time.monotonic() - start_time
+            
+            # Get token usage
+            token_stats = get_token_usage()
+            
+            # Save to combined results CSV
+            with ResultsTracker() as tracker:
                 tracker.add_result(
                     approach=approach_name,
                     results_file=results_path,
@@ -228,38 +337,27 @@ def main():
                     num_tasks=len(task_ids),
                     samples_per_task=num_samples_per_task,
                     input_tokens=token_stats["input_tokens"],
-                    output_tokens=token_stats["output_tokens"]
+                    output_tokens=token_stats["output_tokens"],
+                    timestamp=run_started.strftime("%Y-%m-%d %H:%M:%S"),
+                    batch=use_batch,
                 )
-                
-            else:
-                print("❌ Results file not found after evaluation")
+            
         else:
-            print(f"❌ Evaluation failed: {result.stderr}")
+            print("❌ Results file not found after evaluation")
             
     except Exception as e:
         print(f"❌ Evaluation error: {e}")
 
     # Get final token stats for display
-    if USE_OPENAI_AGENT:
-        from scripts.openai_agent import get_token_usage
-    elif USE_LANGGRAPH:
-        from scripts.langgraph_agent import get_token_usage
-    elif USE_LANGCHAIN:
-        from scripts.langchain_agent import get_token_usage
-    elif USE_QWEN_AGENT:
-        from scripts.qwen_agent import get_token_usage
-    elif USE_CREWAI:
-        from scripts.crewai_agent import get_token_usage
-    else:
-        from scripts.openAI_models import get_token_usage
-    
     final_token_stats = get_token_usage()
     
     print(f"\n{'='*60}")
     print("Process Complete!")
     print(f"{'='*60}")
-    print(f"Total time: {time.time() - start_time:.1f}s")
+    print(f"Total time: {time.monotonic() - start_time:.1f}s")
     print(f"Tokens used: {final_token_stats['input_tokens']:,} input + {final_token_stats['output_tokens']:,} output = {final_token_stats['total_tokens']:,} total")
+    if final_token_stats.get('cached_tokens'):
+        print(f"Prompt-cache hits: {final_token_stats['cached_tokens']:,} of {final_token_stats['input_tokens']:,} input tokens")
     print(f"Results saved to: {results_path}")
     print(f"Combined results: combined_results.csv")
     print(f"{'='*60}\n")
@@ -0,0 +1,40 @@
+# jsonl_utils.py
+"""
+Fast JSONL helpers.
+
+Uses orjson when it is installed and falls back to the stdlib json module.
+Lines are handled as bytes so orjson output can be written without decoding.
+"""
+
+import json
+from typing import Iterable, Dict
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+if orjson is not None:
+    def loads(line) -> Dict:
+        """Parse one JSONL line (str or bytes; a trailing newline is fine)."""
+        return orjson.loads(line)
+
+    def dumps_line(obj: Dict) -> bytes:
+        """Serialize obj as one newline-terminated JSONL line."""
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+else:
+    def loads(line) -> Dict:
+        """Parse one JSONL line (str or bytes; a trailing newline is fine)."""
+        return json.loads(line)
+
+    def dumps_line(obj: Dict) -> bytes:
+        """Serialize obj as one newline-terminated JSONL line."""
+        return (json.dumps(obj) + "\n").encode("utf-8")
+
+
+def write_jsonl(filename: str, data: Iterable[Dict]):
+    """Write an iterable of dicts to filename, one JSON object per line."""
+    with open(filename, 'wb') as f:
+        for obj in data:
+            f.write(dumps_line(obj))
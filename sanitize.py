@@ -8,62 +8,85 @@ We aim to return ONLY the function *body* (suffix) for a given prompt.
 """
 
 import re
+import functools
+
+# Compiled once at import instead of looked up in re's cache on every call
+_DEF_RE = re.compile(r"^\s*def\s+\w+\s*\(.*\)\s*:\s*$")
+
+
+def _has_indented_line(text: str) -> bool:
+    return any(ln[:1].isspace() and ln.strip() for ln in text.splitlines())
 
 
 def _strip_code_fences(text: str) -> str:
-    text = text.strip()
-    # Prefer fenced python blocks if present
-    fenced = re.findall(r"```(?:python)?\s*([\s\S]*?)\s*```", text, flags=re.IGNORECASE)
-    if fenced:
-        return fenced[0].strip()
+    raw, text = text, text.strip()
+    # Prefer fenced python blocks if present (first ```[python] ... ``` pair)
+    start = text.find("```")
+    if start != -1:
+        body_start = start + 3
+        tagged = text[body_start:body_start + 6].lower() == "python"
+        if tagged:
+            body_start += 6
+        end = text.find("```", body_start)
+        if end != -1:
+            return text[body_start:end].strip()
+        # Unclosed ```python (or leading ```) fence, e.g. output cut off at
+        # max_tokens. Only taken after prose: code before the fence is the answer
+        if tagged or start == 0:
+            # strip() removed the first line's indentation; it still marks code
+            indent = raw[:len(raw) - len(raw.lstrip())].rpartition("\n")[2]
+            if not _has_indented_line(indent + text[:start]):
+                return text[body_start:].strip()
     # Generic triple-backtick wrapper
     if text.startswith("```") and text.endswith("```"):
         return text[3:-3].strip()
     return text
 
 
-def _strip_signature_if_present(text: str) -> str:
+# Pure function of its input: repeated outputs (fallback bodies, cache hits,
+# identical samples) are served from memory
+@functools.lru_cache(maxsize=512)
+def sanitize_completion(text: str) -> str:
     """
-    If the model returned a full function (signature + body),
-    drop the first 'def ...:' line but keep the body indented.
+    Compose all sanitizers to produce a clean suffix.
+    The text is split into lines once; fence pruning, signature removal and
+    re-indentation all work on that one list.
     """
-    lines = text.splitlines()
-    if not lines:
-        return text
-
-    # Match a def line with trailing colon.
-    if re.match(r"^\s*def\s+\w+\s*\(.*\)\s*:\s*$", lines[0]):
-        body_lines = lines[1:]
-        text = "\n".join(body_lines).lstrip("\n")
-    else:
-        # If no signature found, ensure proper indentation (4 spaces)
-        # Check if the code is already indented
-        non_empty = [ln for ln in lines if ln.strip()]
-        if non_empty:
-            min_indent = min(len(re.match(r"^[ \t]*", ln).group(0)) for ln in non_empty)
-            if min_indent < 4:
-                # Add 4 spaces indentation to all non-empty lines
-                lines = ["    " + ln if ln.strip() else ln for ln in lines]
-                text = "\n".join(lines)
-
-    # Ensure trailing newline for many HumanEval tasks
-    return text if text.endswith("\n") else (text + "\n")
-
-
-def sanitize_completion(text: str) -> str:
-    """Compose all sanitizers to produce a clean suffix."""
     text = _strip_code_fences(text)
+    lines = text.splitlines()
 
     # prune any trailing fenced code or markdown artifacts
-    lines = []
-    for ln in text.splitlines():
-        if ln.strip().startswith("```"):
+    for i, ln in enumerate(lines):
+        if ln.lstrip().startswith("```"):
+            del lines[i:]
             break
-        lines.append(ln)
-    text = "\n".join(lines).rstrip() + "\n"
 
-    text = _strip_signature_if_present(text)
+    # Drop trailing whitespace (blank lines, then the last line's tail)
+    while lines and not lines[-1].strip():
+        lines.pop()
+    if lines:
+        lines[-1] = lines[-1].rstrip()
+
+    if lines and _DEF_RE.match(lines[0]):
+        # If the model returned a full function (signature + body),
+        # drop the first 'def ...:' line but keep the body indented.
+        del lines[0]
+        while lines and not lines[0]:
+            del lines[0]
+    else:
+        # If no signature found, ensure proper indentation (4 spaces)
+        # Stop at the first under-indented line; lines already starting with
+        # 4 spaces (the usual case) skip the whitespace measurement entirely
+        if any(
+            not ln.startswith("    ") and ln.strip() and len(ln) - len(ln.lstrip(" \t")) < 4
+            for ln in lines
+        ):
+            # Add 4 spaces indentation to all non-empty lines
+            lines = ["    " + ln if ln.strip() else ln for ln in lines]
+
+    text = "\n".join(lines)
 
     # Finally, avoid triple backticks that slipped through
-    text = text.replace("```", "").rstrip() + "\n"
-    return text
\ No newline at end of file
+    if "```" in text:
+        text = text.replace("```", "")
+    return text.rstrip() + "\n"
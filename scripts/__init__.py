@@ -4,7 +4,12 @@ Code generation scripts for HumanEval evaluation.
 
 This package contains:
 - openAI_models.py: Direct OpenAI API implementation
+- openai_batch.py: OpenAI Batch API submission (BATCH_MODE=true)
 - crewai_agent.py: CrewAI agent implementation  
+- llm_cache.py: Disk-backed completion cache (LLM_CACHE=true)
+- llm_clients.py: Shared, pooled OpenAI/LangChain clients
+- fanout.py: Bounded-concurrency generate_many_completions helper
+- token_counter.py: Thread-safe token usage counters
 - sanitize.py: Code sanitization utilities
 """
 
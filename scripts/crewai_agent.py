@@ -6,9 +6,12 @@ Ultra-optimized CrewAI agent that mimics direct API performance.
 import os
 from dotenv import load_dotenv
 from crewai import Agent, Task, Crew
-from langchain_openai import ChatOpenAI
 from langchain_core.callbacks import BaseCallbackHandler
 from sanitize import sanitize_completion
+from scripts.llm_cache import cached_completion
+from scripts.token_counter import TokenCounter, estimate_tokens
+from scripts.fanout import CREWAI_ERROR_COMPLETION, gather_completions
+from scripts.llm_clients import get_chat_openai, close_clients, run_sync
 
 load_dotenv()
 
@@ -18,101 +21,144 @@ TEMPERATURE = float(os.getenv("OPENAI_TEMPERATURE", "0.2"))
 MAX_TOKENS = int(os.getenv("OPENAI_MAX_TOKENS", "512"))
 VERBOSE = os.getenv("CREWAI_VERBOSE", "false").lower() == "true"
 
-# Singleton instances
-_agent_instance = None
-_llm_instance = None
+# Agent backstory, CrewAI's system instructions (also part of the completion cache key)
+_SYSTEM_PROMPT = "Write Python function bodies only."
 
-# Global token tracking
-token_usage = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+# Idle crews, each with its own Agent; a crew serves one kickoff at a time (see _acquire_crew)
+_crew_pool = []
 
-def get_token_usage():
-    """Get current token usage statistics."""
-    return token_usage.copy()
+# Minimal task - closest to direct API prompt; {prompt} is filled in per kickoff
+# (also part of the completion cache key)
+_TASK_DESCRIPTION = "{prompt}\n\n# Write ONLY the function body below, nothing else."
 
-def reset_token_usage():
-    """Reset token usage statistics."""
-    global token_usage
-    token_usage = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+# Global token tracking (thread-safe, see scripts/token_counter.py)
+token_usage = TokenCounter()
+get_token_usage = token_usage.snapshot
+reset_token_usage = token_usage.reset
 
 
 def _get_llm():
-    """Get or create LLM instance (singleton)."""
-    global _llm_instance
-    if _llm_instance is None:
-        _llm_instance = ChatOpenAI(
-            model=MODEL,
-            temperature=TEMPERATURE,
-            max_tokens=MAX_TOKENS,
-            api_key=os.getenv("OPENAI_API_KEY"),
-        )
-    return _llm_instance
-
-
-def _get_code_agent():
-    """Get ultra-minimal agent (singleton)."""
-    global _agent_instance
-    if _agent_instance is None:
-        _agent_instance = Agent(
-            role="Code Generator",
-            goal="Write function bodies",
-            backstory="Write Python function bodies only.",
-            llm=_get_llm(),
-            verbose=False,  # Always silent
-            allow_delegation=False,
-            max_iter=1,
-        )
-    return _agent_instance
+    """Get the shared LLM instance (see scripts/llm_clients.py)."""
+    return get_chat_openai(MODEL, TEMPERATURE, MAX_TOKENS, os.getenv("OPENAI_API_KEY"))
 
 
+def _build_code_agent() -> Agent:
+    """
+    Build an ultra-minimal agent. CrewAI keeps per-run state on the Agent
+    (its executor and crew), so every pooled crew gets its own.
+    """
+    return Agent(
+        role="Code Generator",
+        goal="Write function bodies",
+        backstory=_SYSTEM_PROMPT,
+        llm=_get_llm(),
+        verbose=False,  # Always silent
+        allow_delegation=False,
+        max_iter=1,
+    )
+
+
+def _build_crew() -> Crew:
+    """Build a single-task crew around a fresh agent; the prompt is passed as a kickoff input."""
+    agent = _build_code_agent()
+    
+    task = Task(
+        description=_TASK_DESCRIPTION,
+        expected_output="Function body",
+        agent=agent,
+    )
+    
+    return Crew(
+        agents=[agent],
+        tasks=[task],
+        verbose=False,  # Always silent
+    )
+
+
+def _acquire_crew() -> Crew:
+    """
+    Take an idle crew from the pool, building one only when all are busy.
+    Concurrent calls never share a crew or its agent, so the pool grows to the
+    concurrency level.
+    """
+    try:
+        return _crew_pool.pop()
+    except IndexError:
+        return _build_crew()
+
+
+def _handle_result(prompt: str, result) -> str:
+    """Extract the raw output, track token usage and sanitize."""
+    # Extract string
+    if hasattr(result, 'raw'):
+        raw_output = result.raw
+    elif isinstance(result, str):
+        raw_output = result
+    else:
+        raw_output = str(result)
+    
+    # Estimate token usage (rough approximation)
+    # CrewAI typically uses more tokens due to agent overhead
+    estimated_input = estimate_tokens(prompt, MODEL)
+    estimated_output = estimate_tokens(raw_output, MODEL)
+    
+    token_usage.add(estimated_input, estimated_output)
+    
+    return sanitize_completion(raw_output)
+
+
+@cached_completion("crewai", MODEL, TEMPERATURE, token_usage, _SYSTEM_PROMPT, _TASK_DESCRIPTION)
 def generate_one_completion(prompt: str) -> str:
     """
     Ultra-optimized CrewAI completion that mimics direct API.
     """
     try:
-        agent = _get_code_agent()
-        
-        # Minimal task - closest to direct API prompt
-        task = Task(
-            description=f"{prompt}\n\n# Write ONLY the function body below, nothing else.",
-            expected_output="Function body",
-            agent=agent,
-        )
+        crew = _acquire_crew()
+        try:
+            result = crew.kickoff(inputs={"prompt": prompt})
+        finally:
+            _crew_pool.append(crew)
+        return _handle_result(prompt, result)
         
-        crew = Crew(
-            agents=[agent],
-            tasks=[task],
-            verbose=False,  # Always silent
-        )
-        
-        result = crew.kickoff()
-        
-        # Extract string
-        if hasattr(result, 'raw'):
-            raw_output = result.raw
-        elif isinstance(result, str):
-            raw_output = result
-        else:
-            raw_output = str(result)
-        
-        # Estimate token usage (rough approximation)
-        # CrewAI typically uses more tokens due to agent overhead
-        estimated_input = len(prompt.split()) * 1.3  # Rough token estimation
-        estimated_output = len(raw_output.split()) * 1.3
-        
-        token_usage["input_tokens"] += int(estimated_input)
-        token_usage["output_tokens"] += int(estimated_output)
-        token_usage["total_tokens"] += int(estimated_input + estimated_output)
-        
-        return sanitize_completion(raw_output)
+    except Exception as e:
+        print(f"\n❌ CrewAI error: {e}")
+        return CREWAI_ERROR_COMPLETION
+
+
+@cached_completion("crewai", MODEL, TEMPERATURE, token_usage, _SYSTEM_PROMPT, _TASK_DESCRIPTION)
+async def agenerate_one_completion(prompt: str) -> str:
+    """Async variant of generate_one_completion using Crew.kickoff_async."""
+    try:
+        crew = _acquire_crew()
+        try:
+            result = await crew.kickoff_async(inputs={"prompt": prompt})
+        finally:
+            _crew_pool.append(crew)
+        return _handle_result(prompt, result)
         
     except Exception as e:
         print(f"\n❌ CrewAI error: {e}")
-        return "    pass\n"
+        return CREWAI_ERROR_COMPLETION
 
 
-def reset_agent():
-    """Reset singleton instances."""
-    global _agent_instance, _llm_instance
-    _agent_instance = None
-    _llm_instance = None
+async def generate_many_completions(prompts: list, max_concurrency: int = 16) -> list:
+    """Complete many prompts concurrently, at most max_concurrency requests in flight."""
+    return await gather_completions(agenerate_one_completion, prompts, max_concurrency)
+
 
+def generate_many_completions_sync(prompts: list, max_concurrency: int = 16) -> list:
+    """
+    Blocking wrapper around generate_many_completions. The async clients are
+    closed with this call's event loop (see llm_clients.run_sync), so the
+    agent holding them is rebuilt on next use.
+    """
+    try:
+        return run_sync(generate_many_completions(prompts, max_concurrency))
+    finally:
+        reset_agent()
+
+
+def reset_agent():
+    """Drop pooled crews and the shared clients."""
+    _crew_pool.clear()
+    close_clients()
@@ -0,0 +1,42 @@
+# fanout.py
+"""
+Bounded-concurrency fan-out of independent prompts.
+
+Every backend exposes generate_many_completions(prompts) built on
+gather_completions: all prompts are scheduled at once and an
+asyncio.Semaphore caps how many requests are in flight.
+"""
+
+import asyncio
+from typing import Awaitable, Callable, List
+
+# Fallback bodies returned when a backend produced no usable completion;
+# shared so llm_cache and the driver recognise the same sentinels
+EMPTY_COMPLETION = "    pass  # No response generated"
+ERROR_COMPLETION = "    pass  # Error generating completion"
+# CrewAI's own error fallback, a bare body
+CREWAI_ERROR_COMPLETION = "    pass\n"
+
+
+async def gather_completions(
+    agenerate: Callable[[str], Awaitable[str]],
+    prompts: List[str],
+    max_concurrency: int = 16,
+) -> List[str]:
+    """Run agenerate over prompts concurrently and return completions in prompt order."""
+    sem = asyncio.Semaphore(max_concurrency)
+
+    async def run_one(prompt: str) -> str:
+        async with sem:
+            return await agenerate(prompt)
+
+    results = await asyncio.gather(*(run_one(prompt) for prompt in prompts), return_exceptions=True)
+
+    completions = []
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"❌ Generation error: {result}")
+            completions.append(ERROR_COMPLETION)
+        else:
+            completions.append(result)
+    return completions
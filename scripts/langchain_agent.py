@@ -8,9 +8,12 @@ Similar structure to CrewAI and Qwen-Agent: Agent + Direct Response (no tools)
 import os
 from dotenv import load_dotenv
 from langchain.agents import AgentExecutor, create_openai_tools_agent
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 from sanitize import sanitize_completion
+from scripts.llm_cache import cached_completion
+from scripts.token_counter import TokenCounter, estimate_tokens
+from scripts.fanout import EMPTY_COMPLETION, ERROR_COMPLETION, gather_completions
+from scripts.llm_clients import get_chat_openai, close_clients, run_sync
 
 load_dotenv()
 
@@ -19,35 +22,24 @@ MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
 TEMPERATURE = float(os.getenv("OPENAI_TEMPERATURE", "0.2"))
 MAX_TOKENS = int(os.getenv("OPENAI_MAX_TOKENS", "512"))
 
-# Global token tracking
-token_usage = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+# Instructions sent with every request (also part of the completion cache key)
+_SYSTEM_PROMPT = (
+    "You are a Python code generator. When given a HumanEval problem, "
+    "generate only the function body code. Do not include the function signature, "
+    "docstring, or any explanations. Just return the indented function body."
+)
 
-def get_token_usage():
-    """Get current token usage statistics."""
-    return token_usage.copy()
-
-def reset_token_usage():
-    """Reset token usage statistics."""
-    global token_usage
-    token_usage = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+# Global token tracking (thread-safe, see scripts/token_counter.py)
+token_usage = TokenCounter()
+get_token_usage = token_usage.snapshot
+reset_token_usage = token_usage.reset
 
 # Singleton instances
 _agent_executor = None
-_llm_instance = None
 
 def _get_llm():
-    """Get or create OpenAI LLM instance (singleton)."""
-    global _llm_instance
-    
-    if _llm_instance is None:
-        _llm_instance = ChatOpenAI(
-            model=MODEL,
-            temperature=TEMPERATURE,
-            max_tokens=MAX_TOKENS,
-            api_key=os.getenv("OPENAI_API_KEY")
-        )
-    
-    return _llm_instance
+    """Get the shared OpenAI LLM instance (see scripts/llm_clients.py)."""
+    return get_chat_openai(MODEL, TEMPERATURE, MAX_TOKENS, os.getenv("OPENAI_API_KEY"))
 
 def _get_agent_executor():
     """Get or create LangChain Agent Executor instance (singleton)."""
@@ -59,7 +51,7 @@ def _get_agent_executor():
         
         # Create a simple prompt template for direct code generation
         prompt_template = ChatPromptTemplate.from_messages([
-            ("system", """You are a Python code generator. When given a HumanEval problem, generate only the function body code. Do not include the function signature, docstring, or any explanations. Just return the indented function body."""),
+            ("system", _SYSTEM_PROMPT),
             ("user", "{input}")
         ])
         
@@ -76,65 +68,88 @@ def _get_agent_executor():
                 # Generate response
                 response = chain.invoke(inputs)
                 return {"output": response.content if hasattr(response, 'content') else str(response)}
+            
+            async def ainvoke(self, inputs):
+                chain = self.prompt_template | self.llm
+                response = await chain.ainvoke(inputs)
+                return {"output": response.content if hasattr(response, 'content') else str(response)}
         
         _agent_executor = SimpleAgentExecutor(llm, prompt_template)
     
     return _agent_executor
 
+# Fixed wrapper around every prompt
+_PREFIX = "Generate the function body for this HumanEval problem:\n\n"
+_SUFFIX = "\n\nGenerate only the function body code, no explanations or markdown."
+_PROMPT_TEMPLATE = _PREFIX + "{prompt}" + _SUFFIX  # part of the completion cache key
+
+def _build_input(prompt: str) -> str:
+    """Create a focused prompt for the agent."""
+    return _PREFIX + prompt + _SUFFIX
+
+def _input_tokens(prompt: str) -> int:
+    """Tokens in _build_input(prompt); the wrapper's count is computed once and cached."""
+    return estimate_tokens(_PREFIX + _SUFFIX, MODEL) + estimate_tokens(prompt, MODEL)
+
+def _handle_result(prompt: str, result) -> str:
+    """Extract code from the executor output, track token usage and sanitize."""
+    if result and "output" in result:
+        response = result["output"]
+        
+        # Estimate token usage (since LangChain doesn't provide exact counts)
+        estimated_input = _input_tokens(prompt)
+        estimated_output = estimate_tokens(response, MODEL)
+        
+        token_usage.add(estimated_input, estimated_output)
+        
+        return sanitize_completion(response)
+    
+    return EMPTY_COMPLETION
+
+@cached_completion("langchain", MODEL, TEMPERATURE, token_usage, _SYSTEM_PROMPT, _PROMPT_TEMPLATE)
 def generate_one_completion(prompt: str) -> str:
     """
     Generate a single completion using LangChain Agent Executor.
     Agent Executor approach with NO TOOLS - similar to CrewAI and Qwen-Agent.
     """
     try:
-        # Get the agent executor
-        agent_executor = _get_agent_executor()
+        agent_input = _build_input(prompt)
+        result = _get_agent_executor().invoke({"input": agent_input})
+        return _handle_result(prompt, result)
         
-        # Create a focused prompt for the agent
-        agent_input = f"""Generate the function body for this HumanEval problem:
-
-{prompt}
+    except Exception as e:
+        print(f"❌ LangChain Agent error: {e}")
+        return ERROR_COMPLETION
 
-Generate only the function body code, no explanations or markdown."""
-        
-        # Run the agent
-        result = agent_executor.invoke({"input": agent_input})
-        
-        # Extract the response
-        if result and "output" in result:
-            response = result["output"]
-            
-            # Extract code from the response
-            if '```python' in response:
-                # Extract code from markdown
-                start = response.find('```python') + 9
-                end = response.find('```', start)
-                if end > start:
-                    code = response[start:end].strip()
-                else:
-                    code = response[start:].strip()
-            else:
-                # Use response directly
-                code = response
-            
-            # Estimate token usage (since LangChain doesn't provide exact counts)
-            estimated_input = len(agent_input.split()) * 1.3
-            estimated_output = len(code.split()) * 1.3
-            
-            token_usage["input_tokens"] += int(estimated_input)
-            token_usage["output_tokens"] += int(estimated_output)
-            token_usage["total_tokens"] += int(estimated_input + estimated_output)
-            
-            return sanitize_completion(code)
-        
-        return "    pass  # No response generated"
+@cached_completion("langchain", MODEL, TEMPERATURE, token_usage, _SYSTEM_PROMPT, _PROMPT_TEMPLATE)
+async def agenerate_one_completion(prompt: str) -> str:
+    """Async variant of generate_one_completion using the chain's ainvoke."""
+    try:
+        agent_input = _build_input(prompt)
+        result = await _get_agent_executor().ainvoke({"input": agent_input})
+        return _handle_result(prompt, result)
         
     except Exception as e:
         print(f"❌ LangChain Agent error: {e}")
-        return "    pass  # Error generating completion"
+        return ERROR_COMPLETION
+
+async def generate_many_completions(prompts: list, max_concurrency: int = 16) -> list:
+    """Complete many prompts concurrently, at most max_concurrency requests in flight."""
+    return await gather_completions(agenerate_one_completion, prompts, max_concurrency)
+
+def generate_many_completions_sync(prompts: list, max_concurrency: int = 16) -> list:
+    """
+    Blocking wrapper around generate_many_completions. The async clients are
+    closed with this call's event loop (see llm_clients.run_sync), so the
+    agent holding them is rebuilt on next use.
+    """
+    try:
+        return run_sync(generate_many_completions(prompts, max_concurrency))
+    finally:
+        reset_agent()
 
 def reset_agent():
     """Reset singleton instances."""
-    global _agent_executor, _llm_instance
+    global _agent_executor
     _agent_executor = None
-    _llm_instance = None
\ No newline at end of file
+    close_clients()
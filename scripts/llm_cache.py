@@ -0,0 +1,251 @@
+# llm_cache.py
+"""
+Disk-backed exact-match cache for generated completions.
+
+Enabled with LLM_CACHE=true. Entries are keyed by a SHA-256 of
+(agent, model, temperature, system prompt, prompt template, prompt) and
+appended to a JSONL file so repeated benchmark runs skip API calls they
+have already paid for.
+
+With temperature 0 every sample of a task shares one entry. With
+temperature > 0 the sample number is part of the key, so only the
+same sample of a later run hits and sampling diversity is preserved.
+
+Each entry stores the token counts its backend recorded when it was
+generated, and cache hits add those to the backend's usage counter, so
+reported token totals and cost stay comparable between cold and warm
+runs.
+"""
+
+import os
+import json
+import hashlib
+import inspect
+import functools
+import threading
+from dotenv import load_dotenv
+from jsonl_utils import loads, dumps_line
+from scripts.fanout import CREWAI_ERROR_COMPLETION, EMPTY_COMPLETION, ERROR_COMPLETION
+from scripts.token_counter import estimate_tokens, record_call
+
+load_dotenv()
+
+CACHE_ENABLED = os.getenv("LLM_CACHE", "false").lower() == "true"
+CACHE_FILE = os.getenv("LLM_CACHE_FILE", os.path.join("outputs", ".llm_cache.jsonl"))
+
+# Fallback completions returned on errors must never be persisted (nor
+# blank ones, e.g. an empty or filtered response sanitized to "\n")
+_UNCACHEABLE = {
+    CREWAI_ERROR_COMPLETION,
+    EMPTY_COMPLETION,
+    ERROR_COMPLETION,
+}
+
+_entries = None
+_lock = threading.Lock()
+# Set when the file ends in a partial line (e.g. a run killed mid-append)
+_needs_newline = False
+
+
+def _load_entries() -> dict:
+    """
+    Load the cache file into memory on first use. Lines that do not decode
+    (truncated or corrupt writes) are skipped: a damaged entry is a miss.
+    """
+    global _entries, _needs_newline
+    if _entries is None:
+        _entries = {}
+        if os.path.exists(CACHE_FILE):
+            with open(CACHE_FILE, 'rb') as f:
+                data = f.read()
+            _needs_newline = bool(data) and not data.endswith(b"\n")
+            skipped = 0
+            for line in data.splitlines():
+                if line.strip():
+                    try:
+                        entry = loads(line)
+                        _entries[entry.pop("key")] = entry
+                    except (ValueError, KeyError, AttributeError, TypeError):
+                        skipped += 1
+            if skipped:
+                print(f"⚠️  Skipped {skipped} unreadable line(s) in {CACHE_FILE}")
+    return _entries
+
+
+def make_key(agent_type: str, model: str, temperature: float, prompt: str,
+             sample_num: int = 0, system: str = "", template: str = "") -> str:
+    """Build the cache key for a single completion request."""
+    payload = {
+        "agent": agent_type,
+        "model": model,
+        "temperature": temperature,
+        "prompt": prompt,
+    }
+    # Editing a backend's instructions must not serve completions made under the old ones
+    if system:
+        payload["system"] = system
+    if template:
+        payload["template"] = template
+    if temperature > 0:
+        payload["sample_num"] = sample_num
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def get(key: str):
+    """
+    Return the cached entry for key ({"completion", "input_tokens",
+    "output_tokens"}; counts are absent in older files), or None.
+    """
+    with _lock:
+        return _load_entries().get(key)
+
+
+def put(key: str, completion: str, input_tokens: int, output_tokens: int):
+    """Store a completion and its token counts in memory and append it to the cache file."""
+    if completion in _UNCACHEABLE or not completion.strip():
+        return
+    entry = {"completion": completion, "input_tokens": input_tokens, "output_tokens": output_tokens}
+    global _needs_newline
+    with _lock:
+        entries = _load_entries()
+        if key in entries:
+            return
+        entries[key] = entry
+        os.makedirs(os.path.dirname(CACHE_FILE) or ".", exist_ok=True)
+        with open(CACHE_FILE, 'ab') as f:
+            if _needs_newline:
+                # Terminate a partial last line so this entry stays readable
+                f.write(b"\n")
+                _needs_newline = False
+            f.write(dumps_line({"key": key, **entry}))
+
+
+def _replay_usage(usage, model: str, prompt, entries):
+    """
+    Account a served-from-cache request in the usage counter (if given) with
+    the counts stored in its entries; entries without them are estimated.
+    prompt is None when the prompt is billed by a request still being sent.
+    """
+    if usage is None:
+        return
+    if prompt is None:
+        input_tokens = 0
+    elif "input_tokens" in entries[0]:
+        input_tokens = entries[0]["input_tokens"]
+    else:
+        input_tokens = estimate_tokens(prompt, model)
+    output_tokens = sum(
+        entry["output_tokens"] if "output_tokens" in entry else estimate_tokens(entry["completion"], model)
+        for entry in entries
+    )
+    usage.add(input_tokens, output_tokens)
+
+
+def cached_completion(agent_type: str, model: str, temperature: float, usage=None,
+                      system: str = "", template: str = ""):
+    """
+    Decorate a (sync or async) generate_one_completion(prompt) function.
+
+    The wrapped function accepts an optional sample_num keyword used for the
+    cache key; it is not forwarded to the generator. system is the backend's
+    static instructions and template the text wrapped around each prompt,
+    with a {prompt} placeholder; both are folded into the key. The tokens
+    the generator adds to any TokenCounter are stored with the entry, and
+    hits replay them into the usage TokenCounter, if one is passed. A no-op
+    unless LLM_CACHE=true.
+    """
+    def decorator(func):
+        if not CACHE_ENABLED:
+            @functools.wraps(func)
+            def passthrough(prompt: str, sample_num: int = 0):
+                return func(prompt)
+            return passthrough
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(prompt: str, sample_num: int = 0):
+                key = make_key(agent_type, model, temperature, prompt, sample_num, system, template)
+                cached = get(key)
+                if cached is not None:
+                    _replay_usage(usage, model, prompt, [cached])
+                    return cached["completion"]
+                with record_call() as tally:
+                    completion = await func(prompt)
+                put(key, completion, *tally)
+                return completion
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(prompt: str, sample_num: int = 0):
+            key = make_key(agent_type, model, temperature, prompt, sample_num, system, template)
+            cached = get(key)
+            if cached is not None:
+                _replay_usage(usage, model, prompt, [cached])
+                return cached["completion"]
+            with record_call() as tally:
+                completion = func(prompt)
+            put(key, completion, *tally)
+            return completion
+        return wrapper
+
+    return decorator
+
+
+def cached_completions(agent_type: str, model: str, temperature: float, usage=None,
+                       system: str = "", template: str = ""):
+    """
+    Decorate a (sync or async) generate_n_completions(prompt, n) function.
+
+    Each of the n samples is looked up under its own sample number; only the
+    missing ones are requested, in a single call whose output tokens are split
+    evenly across the new entries. Hits replay their stored counts into the
+    usage TokenCounter, if one is passed. A no-op unless LLM_CACHE=true.
+    """
+    def decorator(func):
+        if not CACHE_ENABLED:
+            return func
+
+        def lookup(prompt: str, n: int):
+            keys = [make_key(agent_type, model, temperature, prompt, i, system, template) for i in range(n)]
+            cached = [get(key) for key in keys]
+            hits = [entry for entry in cached if entry is not None]
+            if hits:
+                # The prompt is billed once per request; count it only if none is sent
+                _replay_usage(usage, model, None if len(hits) < n else prompt, hits)
+            return keys, [entry and entry["completion"] for entry in cached]
+
+        def fill(keys, completions, fresh, tally):
+            input_tokens, output_tokens = tally
+            share, extra = divmod(output_tokens, len(fresh))
+            fresh = iter(fresh)
+            for i, key in enumerate(keys):
+                if completions[i] is None:
+                    completions[i] = next(fresh)
+                    put(key, completions[i], input_tokens, share + (extra > 0))
+                    extra -= 1
+            return completions
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(prompt: str, n: int):
+                keys, completions = lookup(prompt, n)
+                missing = completions.count(None)
+                if missing:
+                    with record_call() as tally:
+                        fresh = await func(prompt, missing)
+                    fill(keys, completions, fresh, tally)
+                return completions
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(prompt: str, n: int):
+            keys, completions = lookup(prompt, n)
+            missing = completions.count(None)
+            if missing:
+                with record_call() as tally:
+                    fresh = func(prompt, missing)
+                fill(keys, completions, fresh, tally)
+            return completions
+        return wrapper
+
+    return decorator
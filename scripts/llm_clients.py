@@ -0,0 +1,126 @@
+# llm_clients.py
+"""
+Process-wide registry of OpenAI / LangChain clients.
+
+Every backend shares one pooled HTTP client (sync and async) instead of
+opening its own connection pool, so TLS sessions and keep-alive
+connections are reused across modules. HTTP/2 is used when the optional
+`h2` package is installed.
+"""
+
+import asyncio
+import functools
+import httpx
+from openai import OpenAI, AsyncOpenAI
+
+try:
+    import h2  # noqa: F401  (enables httpx HTTP/2 support)
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
+
+_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=64)
+_TIMEOUT = httpx.Timeout(600.0, connect=10.0)
+
+# aclose() tasks scheduled by close_clients on a running loop, kept until done
+_closing = set()
+
+
+@functools.lru_cache(maxsize=None)
+def get_http_client() -> httpx.Client:
+    """Shared synchronous connection pool."""
+    return httpx.Client(limits=_LIMITS, timeout=_TIMEOUT, http2=_HTTP2)
+
+
+@functools.lru_cache(maxsize=None)
+def get_async_http_client() -> httpx.AsyncClient:
+    """Shared asynchronous connection pool."""
+    return httpx.AsyncClient(limits=_LIMITS, timeout=_TIMEOUT, http2=_HTTP2)
+
+
+@functools.lru_cache(maxsize=None)
+def get_openai_client(base_url: str = None, api_key: str = None) -> OpenAI:
+    """
+    Shared openai.OpenAI client per (base_url, api_key); unset values are
+    read from the OPENAI_* env vars.
+    """
+    return OpenAI(base_url=base_url, api_key=api_key, http_client=get_http_client())
+
+
+@functools.lru_cache(maxsize=None)
+def get_async_openai_client() -> AsyncOpenAI:
+    """Shared openai.AsyncOpenAI client (configured from OPENAI_* env vars)."""
+    return AsyncOpenAI(http_client=get_async_http_client())
+
+
+@functools.lru_cache(maxsize=8)
+def get_chat_openai(model: str, temperature: float, max_tokens: int, api_key: str = None):
+    """
+    One LangChain ChatOpenAI per (model, temperature, max_tokens, api_key),
+    shared by the CrewAI, LangChain and LangGraph backends.
+    """
+    from langchain_openai import ChatOpenAI
+
+    return ChatOpenAI(
+        model=model,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        api_key=api_key,
+        http_client=get_http_client(),
+        http_async_client=get_async_http_client(),
+    )
+
+
+async def aclose_async_clients():
+    """
+    Close the shared async pool and forget every client built on it. Its
+    keep-alive connections belong to the event loop that opened them, so
+    this has to run on that loop before it ends (see run_sync).
+    """
+    if get_async_http_client.cache_info().currsize:
+        await get_async_http_client().aclose()
+    for getter in (get_chat_openai, get_async_openai_client, get_async_http_client):
+        getter.cache_clear()
+
+
+def run_sync(coro):
+    """
+    asyncio.run(coro), closing the shared async clients before its loop ends
+    so a later run builds fresh ones instead of reusing connections of a
+    closed loop.
+    """
+    async def main():
+        try:
+            return await coro
+        finally:
+            await aclose_async_clients()
+    return asyncio.run(main())
+
+
+def _close_async_http_client(client: httpx.AsyncClient):
+    """aclose() the async pool from synchronous code, on the running loop if there is one."""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        try:
+            asyncio.run(client.aclose())
+        except RuntimeError:
+            pass  # connections of an already closed loop; their sockets go with them
+        return
+    task = loop.create_task(client.aclose())
+    _closing.add(task)
+    task.add_done_callback(_closing.discard)
+
+
+def close_clients():
+    """
+    Close the shared connection pools and forget every cached client;
+    the next get_* call builds fresh ones (e.g. for a new event loop).
+    """
+    if get_http_client.cache_info().currsize:
+        get_http_client().close()
+    if get_async_http_client.cache_info().currsize:
+        _close_async_http_client(get_async_http_client())
+    for getter in (get_chat_openai, get_async_openai_client, get_openai_client,
+                   get_async_http_client, get_http_client):
+        getter.cache_clear()
@@ -1,8 +1,12 @@
 # OpenAI_models.py
 import os
+from urllib.parse import urlparse
 from dotenv import load_dotenv
-from openai import OpenAI
 from sanitize import sanitize_completion
+from scripts.llm_cache import cached_completion, cached_completions
+from scripts.token_counter import TokenCounter
+from scripts.fanout import gather_completions
+from scripts.llm_clients import get_openai_client, get_async_openai_client, run_sync
 
 load_dotenv()
 
@@ -10,56 +14,108 @@ MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
 TEMPERATURE = float(os.getenv("OPENAI_TEMPERATURE", "0.2"))
 MAX_TOKENS = int(os.getenv("OPENAI_MAX_TOKENS", "300"))
 
-_client = OpenAI()
+# System message sent with every request (also part of the completion cache key)
+_SYSTEM_PROMPT = (
+    "You complete Python functions from a provided signature+docstring. "
+    "Return ONLY the function body (the indented code after the signature). "
+    "Do not repeat the signature. Do not add imports. "
+    "Do not include explanations or markdown."
+)
+# Shared by every request (never mutated); only the user message is built per call
+_SYSTEM_MSG = {"role": "system", "content": _SYSTEM_PROMPT}
+_USER_SUFFIX = "\n\n# Write ONLY the function body below, nothing else."
+_PROMPT_TEMPLATE = "{prompt}" + _USER_SUFFIX  # part of the completion cache key
 
-# Global token tracking
-token_usage = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+# Self-hosted OpenAI-compatible server (llama.cpp, vLLM) on this machine?
+BASE_URL = os.getenv("OPENAI_BASE_URL", "")
+LOCAL_SERVER = urlparse(BASE_URL).hostname in {"localhost", "127.0.0.1", "0.0.0.0", "::1"}
 
-def get_token_usage():
-    """Get current token usage statistics."""
-    return token_usage.copy()
+# Stop sequences, built once (serialized as a JSON array like a list)
+_STOP = (
+    "\n\n\n",
+    "\nif __name__ == '__main__':",
+    "\nif __name__ == \"__main__\":",
+)
 
-def reset_token_usage():
-    """Reset token usage statistics."""
-    global token_usage
-    token_usage = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+# Global token tracking (thread-safe, see scripts/token_counter.py)
+token_usage = TokenCounter()
+get_token_usage = token_usage.snapshot
+reset_token_usage = token_usage.reset
 
-def generate_one_completion(prompt: str) -> str:
-    """
-    Given a HumanEval prompt (signature + docstring), return ONLY the function body.
-    Simple Chat Completions call, no retries. Sanitization is handled in sanitize.py.
-    """
-    resp = _client.chat.completions.create(
+def build_request(prompt: str, n: int = 1) -> dict:
+    """Build the Chat Completions arguments shared by the sync, async and batch paths."""
+    kwargs = dict(
         model=MODEL,
         temperature=TEMPERATURE,
         max_tokens=MAX_TOKENS,
+        n=n,
         messages=[
-            {
-                "role": "system",
-                "content": (
-                    "You complete Python functions from a provided signature+docstring. "
-                    "Return ONLY the function body (the indented code after the signature). "
-                    "Do not repeat the signature. Do not add imports. "
-                    "Do not include explanations or markdown."
-                ),
-            },
-            {
-                "role": "user",
-                "content": prompt + "\n\n# Write ONLY the function body below, nothing else.",
-            },
-        ],
-        stop=[
-            "\n\n\n",
-            "\nif __name__ == '__main__':",
-            "\nif __name__ == \"__main__\":",
+            _SYSTEM_MSG,
+            {"role": "user", "content": prompt + _USER_SUFFIX},
         ],
+        stop=_STOP,
     )
-    
-    # Track token usage
+    if LOCAL_SERVER:
+        # Keep the prompt's KV cache on the server so repeated samples skip prefill
+        # (llama.cpp honours cache_prompt; vLLM shares prefill across n= choices)
+        kwargs["extra_body"] = {"cache_prompt": True}
+    return kwargs
+
+def _handle_response(resp) -> list:
+    """Track token usage and return the sanitized completion of every choice."""
     if hasattr(resp, 'usage') and resp.usage:
-        token_usage["input_tokens"] += resp.usage.prompt_tokens
-        token_usage["output_tokens"] += resp.usage.completion_tokens
-        token_usage["total_tokens"] += resp.usage.total_tokens
+        # Prompt-prefix cache hits (OpenAI caches shared prefixes of 1024+ tokens)
+        details = getattr(resp.usage, 'prompt_tokens_details', None)
+        cached = getattr(details, 'cached_tokens', None) or 0
+        token_usage.add(resp.usage.prompt_tokens, resp.usage.completion_tokens, cached)
     
-    raw = (resp.choices[0].message.content or "").strip()
-    return sanitize_completion(raw)
\ No newline at end of file
+    return [
+        sanitize_completion((choice.message.content or "").strip())
+        for choice in resp.choices
+    ]
+
+@cached_completion("direct", MODEL, TEMPERATURE, token_usage, _SYSTEM_PROMPT, _PROMPT_TEMPLATE)
+def generate_one_completion(prompt: str) -> str:
+    """
+    Given a HumanEval prompt (signature + docstring), return ONLY the function body.
+    Simple Chat Completions call, no retries. Sanitization is handled in sanitize.py.
+    """
+    resp = get_openai_client().chat.completions.create(**build_request(prompt))
+    return _handle_response(resp)[0]
+
+@cached_completion("direct", MODEL, TEMPERATURE, token_usage, _SYSTEM_PROMPT, _PROMPT_TEMPLATE)
+async def agenerate_one_completion(prompt: str) -> str:
+    """Async variant of generate_one_completion using the AsyncOpenAI client."""
+    resp = await get_async_openai_client().chat.completions.create(**build_request(prompt))
+    return _handle_response(resp)[0]
+
+@cached_completions("direct", MODEL, TEMPERATURE, token_usage, _SYSTEM_PROMPT, _PROMPT_TEMPLATE)
+def generate_n_completions(prompt: str, n: int) -> list:
+    """
+    Return n function bodies for one prompt from a single request (Chat Completions `n=`).
+    The prompt is sent and prefilled once instead of n times.
+    """
+    completions = _handle_response(get_openai_client().chat.completions.create(**build_request(prompt, n)))
+    # Servers without n= support (e.g. llama.cpp) return a single choice
+    while len(completions) < n:
+        resp = get_openai_client().chat.completions.create(**build_request(prompt, n - len(completions)))
+        completions += _handle_response(resp)
+    return completions
+
+@cached_completions("direct", MODEL, TEMPERATURE, token_usage, _SYSTEM_PROMPT, _PROMPT_TEMPLATE)
+async def agenerate_n_completions(prompt: str, n: int) -> list:
+    """Async variant of generate_n_completions using the AsyncOpenAI client."""
+    completions = _handle_response(await get_async_openai_client().chat.completions.create(**build_request(prompt, n)))
+    # Servers without n= support (e.g. llama.cpp) return a single choice
+    while len(completions) < n:
+        resp = await get_async_openai_client().chat.completions.create(**build_request(prompt, n - len(completions)))
+        completions += _handle_response(resp)
+    return completions
+
+async def generate_many_completions(prompts: list, max_concurrency: int = 16) -> list:
+    """Complete many prompts concurrently, at most max_concurrency requests in flight."""
+    return await gather_completions(agenerate_one_completion, prompts, max_concurrency)
+
+def generate_many_completions_sync(prompts: list, max_concurrency: int = 16) -> list:
+    """Blocking wrapper around generate_many_completions (see llm_clients.run_sync)."""
+    return run_sync(generate_many_completions(prompts, max_concurrency))
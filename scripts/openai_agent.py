@@ -6,9 +6,15 @@ Similar structure to CrewAI, Qwen-Agent, LangChain, and LangGraph: Direct Respon
 """
 
 import os
+import re
+import threading
 from dotenv import load_dotenv
-from agents import Agent, Runner
+from agents import Agent, Runner, set_default_openai_client
 from sanitize import sanitize_completion
+from scripts.llm_cache import cached_completion
+from scripts.token_counter import TokenCounter, estimate_tokens
+from scripts.fanout import EMPTY_COMPLETION, ERROR_COMPLETION, gather_completions
+from scripts.llm_clients import get_async_openai_client, close_clients, run_sync
 
 load_dotenv()
 
@@ -17,89 +23,139 @@ MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
 TEMPERATURE = float(os.getenv("OPENAI_TEMPERATURE", "0.2"))
 MAX_TOKENS = int(os.getenv("OPENAI_MAX_TOKENS", "512"))
 
-# Global token tracking
-token_usage = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+# Instructions sent with every request (also part of the completion cache key)
+_SYSTEM_PROMPT = (
+    "You are a Python code generator. When given a HumanEval problem, "
+    "generate only the function body code. Do not include the function signature, "
+    "docstring, or any explanations. Just return the indented function body."
+)
 
-def get_token_usage():
-    """Get current token usage statistics."""
-    return token_usage.copy()
+# First ```[python] block of a reply, found in a single scan
+_CODE_FENCE = re.compile(r"```(?:python)?\s*\n?(.*?)(?:```|\Z)", re.DOTALL)
 
-def reset_token_usage():
-    """Reset token usage statistics."""
-    global token_usage
-    token_usage = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+# Global token tracking (thread-safe, see scripts/token_counter.py)
+token_usage = TokenCounter()
+get_token_usage = token_usage.snapshot
+reset_token_usage = token_usage.reset
 
 # Singleton instances
 _agent_instance = None
+_agent_lock = threading.Lock()
 
 def _get_openai_agent():
     """Get or create OpenAI Agent instance (singleton)."""
     global _agent_instance
     
+    # Double-checked locking: worker threads must not build the agent twice
     if _agent_instance is None:
-        # Create OpenAI Agent with NO TOOLS (no tools parameter = no tools)
-        _agent_instance = Agent(
-            name="Code Generator",
-            instructions="""You are a Python code generator. When given a HumanEval problem, generate only the function body code. Do not include the function signature, docstring, or any explanations. Just return the indented function body.""",
-            model=MODEL,
-            # No tools parameter = no tools
-        )
+        with _agent_lock:
+            if _agent_instance is None:
+                # Run on the shared async pool, which run_sync closes with its loop
+                set_default_openai_client(get_async_openai_client(), use_for_tracing=False)
+                # Create OpenAI Agent with NO TOOLS (no tools parameter = no tools)
+                _agent_instance = Agent(
+                    name="Code Generator",
+                    instructions=_SYSTEM_PROMPT,
+                    model=MODEL,
+                    # No tools parameter = no tools
+                )
     
     return _agent_instance
 
+# Fixed wrapper around every prompt
+_PREFIX = "Generate the function body for this HumanEval problem:\n\n"
+_SUFFIX = "\n\nGenerate only the function body code, no explanations or markdown."
+_PROMPT_TEMPLATE = _PREFIX + "{prompt}" + _SUFFIX  # part of the completion cache key
+
+def _build_input(prompt: str) -> str:
+    """Create a focused prompt for the agent."""
+    return _PREFIX + prompt + _SUFFIX
+
+def _input_tokens(prompt: str) -> int:
+    """Tokens in _build_input(prompt); the wrapper's count is computed once and cached."""
+    return estimate_tokens(_PREFIX + _SUFFIX, MODEL) + estimate_tokens(prompt, MODEL)
+
+def _result_usage(result):
+    """Exact (input, output, cached input) token counts from the run's model responses, or None."""
+    responses = getattr(result, 'raw_responses', None)
+    if not responses:
+        return None
+    input_tokens = output_tokens = cached_tokens = 0
+    for response in responses:
+        usage = getattr(response, 'usage', None)
+        if usage is None:
+            return None
+        input_tokens += usage.input_tokens
+        output_tokens += usage.output_tokens
+        details = getattr(usage, 'input_tokens_details', None)
+        cached_tokens += getattr(details, 'cached_tokens', None) or 0
+    return input_tokens, output_tokens, cached_tokens
+
+def _handle_result(prompt: str, result) -> str:
+    """Extract code from the run result, track token usage and sanitize."""
+    if result and hasattr(result, 'final_output'):
+        content = result.final_output
+        
+        # Extract code from a markdown fence (unclosed fences run to the end)
+        match = _CODE_FENCE.search(content)
+        code = match.group(1).strip() if match else content
+        
+        usage = _result_usage(result)
+        if usage is None:
+            # Estimate token usage when the run reports none
+            usage = (_input_tokens(prompt), estimate_tokens(code, MODEL))
+        
+        token_usage.add(*usage)
+        
+        return sanitize_completion(code)
+    
+    return EMPTY_COMPLETION
+
+@cached_completion("openai_agent", MODEL, TEMPERATURE, token_usage, _SYSTEM_PROMPT, _PROMPT_TEMPLATE)
 def generate_one_completion(prompt: str) -> str:
     """
     Generate a single completion using OpenAI Agent.
     Direct response approach - similar to CrewAI, Qwen-Agent, LangChain, and LangGraph (no tools).
     """
     try:
-        # Get the OpenAI Agent
-        agent = _get_openai_agent()
-        
-        # Create a focused prompt for the agent
-        agent_input = f"""Generate the function body for this HumanEval problem:
-
-{prompt}
-
-Generate only the function body code, no explanations or markdown."""
-        
+        agent_input = _build_input(prompt)
         # Run the agent synchronously
-        result = Runner.run_sync(agent, agent_input)
-        
-        # Extract the final output
-        if result and hasattr(result, 'final_output'):
-            content = result.final_output
-            
-            # Extract code from the response
-            if '```python' in content:
-                # Extract code from markdown
-                start = content.find('```python') + 9
-                end = content.find('```', start)
-                if end > start:
-                    code = content[start:end].strip()
-                else:
-                    code = content[start:].strip()
-            else:
-                # Use content directly
-                code = content
-            
-            # Estimate token usage (since OpenAI Agents doesn't provide exact counts)
-            estimated_input = len(agent_input.split()) * 1.3
-            estimated_output = len(code.split()) * 1.3
-            
-            token_usage["input_tokens"] += int(estimated_input)
-            token_usage["output_tokens"] += int(estimated_output)
-            token_usage["total_tokens"] += int(estimated_input + estimated_output)
-            
-            return sanitize_completion(code)
+        result = Runner.run_sync(_get_openai_agent(), agent_input)
+        return _handle_result(prompt, result)
         
-        return "    pass  # No response generated"
+    except Exception as e:
+        print(f"❌ OpenAI Agent error: {e}")
+        return ERROR_COMPLETION
+
+@cached_completion("openai_agent", MODEL, TEMPERATURE, token_usage, _SYSTEM_PROMPT, _PROMPT_TEMPLATE)
+async def agenerate_one_completion(prompt: str) -> str:
+    """Async variant of generate_one_completion using Runner.run."""
+    try:
+        agent_input = _build_input(prompt)
+        result = await Runner.run(_get_openai_agent(), agent_input)
+        return _handle_result(prompt, result)
         
     except Exception as e:
         print(f"❌ OpenAI Agent error: {e}")
-        return "    pass  # Error generating completion"
+        return ERROR_COMPLETION
+
+async def generate_many_completions(prompts: list, max_concurrency: int = 16) -> list:
+    """Complete many prompts concurrently, at most max_concurrency requests in flight."""
+    return await gather_completions(agenerate_one_completion, prompts, max_concurrency)
+
+def generate_many_completions_sync(prompts: list, max_concurrency: int = 16) -> list:
+    """
+    Blocking wrapper around generate_many_completions. The async clients are
+    closed with this call's event loop (see llm_clients.run_sync), so the
+    agent holding them is rebuilt on next use.
+    """
+    try:
+        return run_sync(generate_many_completions(prompts, max_concurrency))
+    finally:
+        reset_agent()
 
 def reset_agent():
     """Reset singleton instances."""
     global _agent_instance
     _agent_instance = None
+    close_clients()
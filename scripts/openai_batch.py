@@ -0,0 +1,87 @@
+# openai_batch.py
+"""
+OpenAI Batch API support for offline HumanEval runs (BATCH_MODE=true).
+
+All tasks are serialized into one JSONL batch (one request per task with
+n = samples per task), uploaded, polled until finished and downloaded.
+Batch requests are billed at half the synchronous price and do not count
+against the per-minute rate limits; results arrive within 24 hours.
+"""
+
+import io
+import time
+from typing import Dict, Iterator, List, Tuple
+
+from jsonl_utils import loads, dumps_line
+from sanitize import sanitize_completion
+from scripts import openAI_models
+from scripts.llm_clients import get_openai_client
+
+FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+def build_requests(problems: Dict, task_ids: List[str], num_samples: int) -> List[Dict]:
+    """One Chat Completions request per task, identified by its task_id."""
+    return [
+        {
+            "custom_id": task_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": openAI_models.build_request(problems[task_id]["prompt"], num_samples),
+        }
+        for task_id in task_ids
+    ]
+
+
+def create_batch(requests: List[Dict]) -> str:
+    """Upload the requests as a JSONL file and start a batch. Returns the batch id."""
+    payload = io.BytesIO(b"".join(dumps_line(request) for request in requests))
+    batch_file = get_openai_client().files.create(
+        file=("humaneval_batch.jsonl", payload),
+        purpose="batch",
+    )
+    batch = get_openai_client().batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    return batch.id
+
+
+def poll_batch(batch_id: str, interval: float = 60.0):
+    """Block until the batch reaches a final status and return it."""
+    while True:
+        batch = get_openai_client().batches.retrieve(batch_id)
+        if batch.status in FINAL_STATUSES:
+            return batch
+        counts = batch.request_counts
+        if counts is not None:
+            print(f"  Batch {batch_id}: {batch.status} ({counts.completed}/{counts.total} done)")
+        else:
+            print(f"  Batch {batch_id}: {batch.status}")
+        time.sleep(interval)
+
+
+def fetch_results(batch) -> Iterator[Tuple[str, List[str]]]:
+    """
+    Yield (task_id, completions) for every successful request in the batch.
+    Token usage is added to the direct backend's counters.
+    """
+    if not batch.output_file_id:
+        return
+    content = get_openai_client().files.content(batch.output_file_id)
+    for line in content.read().splitlines():
+        if not line.strip():
+            continue
+        result = loads(line)
+        response = result.get("response") or {}
+        if response.get("status_code") != 200:
+            continue
+        body = response["body"]
+        usage = body.get("usage")
+        if usage:
+            cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+            openAI_models.token_usage.add(usage["prompt_tokens"], usage["completion_tokens"], cached)
+        yield result["custom_id"], [
+            sanitize_completion((choice["message"].get("content") or "").strip())
+            for choice in body["choices"]
+        ]
@@ -6,9 +6,16 @@ Similar structure to CrewAI: Agent + Direct Response
 """
 
 import os
+import re
+import asyncio
+import threading
 from dotenv import load_dotenv
 from qwen_agent.agents import Assistant
 from sanitize import sanitize_completion
+from scripts.llm_cache import cached_completion
+from scripts.token_counter import TokenCounter, estimate_tokens
+from scripts.fanout import EMPTY_COMPLETION, ERROR_COMPLETION, gather_completions
+from scripts.llm_clients import get_openai_client, close_clients, run_sync
 
 load_dotenv()
 
@@ -17,49 +24,85 @@ MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
 TEMPERATURE = float(os.getenv("OPENAI_TEMPERATURE", "0.2"))
 MAX_TOKENS = int(os.getenv("OPENAI_MAX_TOKENS", "512"))
 
-# Global token tracking
-token_usage = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+# Instructions sent with every request (also part of the completion cache key)
+_SYSTEM_PROMPT = (
+    "You are a Python code generator. When given a HumanEval problem, "
+    "generate only the function body code. Do not include the function signature, "
+    "docstring, or any explanations. Just return the indented function body."
+)
 
-def get_token_usage():
-    """Get current token usage statistics."""
-    return token_usage.copy()
+# First ```[python] block of a reply, found in a single scan
+_CODE_FENCE = re.compile(r"```(?:python)?\s*\n?(.*?)(?:```|\Z)", re.DOTALL)
 
-def reset_token_usage():
-    """Reset token usage statistics."""
-    global token_usage
-    token_usage = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+# Global token tracking (thread-safe, see scripts/token_counter.py)
+token_usage = TokenCounter()
+get_token_usage = token_usage.snapshot
+reset_token_usage = token_usage.reset
 
 # Singleton instances
 _agent_instance = None
+_agent_lock = threading.Lock()
+
+_MODEL_SERVER = 'https://api.openai.com/v1'
+
+# Sampling arguments the OpenAI SDK only accepts inside extra_body
+_EXTRA_BODY_PARAMS = ('top_k', 'repetition_penalty')
+
+def _pooled_chat_complete_create(*args, **kwargs):
+    """Drop-in for Qwen-Agent's chat-completions call using the shared OpenAI client."""
+    # A per-request timeout for the client, as in Qwen-Agent's own implementation
+    if 'request_timeout' in kwargs:
+        kwargs['timeout'] = kwargs.pop('request_timeout')
+    if any(k in kwargs for k in _EXTRA_BODY_PARAMS):
+        kwargs['extra_body'] = dict(kwargs.get('extra_body') or {})
+        for k in _EXTRA_BODY_PARAMS:
+            if k in kwargs:
+                kwargs['extra_body'][k] = kwargs.pop(k)
+    client = get_openai_client(_MODEL_SERVER, os.getenv('OPENAI_API_KEY'))
+    return client.chat.completions.create(*args, **kwargs)
 
 def _get_code_agent():
     """Get or create Qwen-Agent instance (singleton)."""
     global _agent_instance
     
+    # Double-checked locking: worker threads must not build the agent twice
     if _agent_instance is None:
-        # Configure LLM to use OpenAI API
-        llm_cfg = {
-            'model': MODEL,
-            'model_server': 'https://api.openai.com/v1',  # OpenAI API endpoint
-            'api_key': os.getenv('OPENAI_API_KEY'),
-            'generate_cfg': {
-                'temperature': TEMPERATURE,
-                'max_tokens': MAX_TOKENS,
-            }
-        }
+        with _agent_lock:
+            if _agent_instance is None:
+                # Configure LLM to use OpenAI API
+                llm_cfg = {
+                    'model': MODEL,
+                    'model_server': _MODEL_SERVER,  # OpenAI API endpoint
+                    'api_key': os.getenv('OPENAI_API_KEY'),
+                    'generate_cfg': {
+                        'temperature': TEMPERATURE,
+                        'max_tokens': MAX_TOKENS,
+                    }
+                }
         
-        # Create agent for direct code generation (no tools)
-        _agent_instance = Assistant(
-            llm=llm_cfg,
-            system_message=(
-                "You are a Python code generator. When given a HumanEval problem, "
-                "generate only the function body code. Do not include the function signature, "
-                "docstring, or any explanations. Just return the indented function body."
-            )
-        )
+                # Create agent for direct code generation (no tools)
+                agent = Assistant(
+                    llm=llm_cfg,
+                    system_message=_SYSTEM_PROMPT
+                )
+                # Qwen-Agent's OpenAI backend builds a new client (and connection
+                # pool) per request; route its calls through one pooled client
+                if hasattr(agent.llm, '_chat_complete_create'):
+                    agent.llm._chat_complete_create = _pooled_chat_complete_create
+                _agent_instance = agent
     
     return _agent_instance
 
+# Fixed wrapper around every prompt
+_PREFIX = "Generate the function body for this HumanEval problem:\n\n"
+_SUFFIX = "\n\nGenerate only the function body code, no explanations or markdown."
+_PROMPT_TEMPLATE = _PREFIX + "{prompt}" + _SUFFIX  # part of the completion cache key
+
+def _input_tokens(prompt: str) -> int:
+    """Tokens in the wrapped prompt; the wrapper's count is computed once and cached."""
+    return estimate_tokens(_PREFIX + _SUFFIX, MODEL) + estimate_tokens(prompt, MODEL)
+
+@cached_completion("qwen_agent", MODEL, TEMPERATURE, token_usage, _SYSTEM_PROMPT, _PROMPT_TEMPLATE)
 def generate_one_completion(prompt: str) -> str:
     """
     Generate a single completion using Qwen-Agent framework.
@@ -70,11 +113,7 @@ def generate_one_completion(prompt: str) -> str:
         agent = _get_code_agent()
         
         # Create a focused prompt for the agent
-        agent_prompt = f"""Generate the function body for this HumanEval problem:
-
-{prompt}
-
-Generate only the function body code, no explanations or markdown."""
+        agent_prompt = _PREFIX + prompt + _SUFFIX
         
         # Create messages for the agent
         messages = [{
@@ -83,9 +122,10 @@ Generate only the function body code, no explanations or markdown."""
         }]
         
         # Run the agent
+        # Each streamed chunk is the full response so far; keep only the last one
         response = []
         for chunk in agent.run(messages=messages):
-            response.extend(chunk)
+            response = chunk
         
         # Extract the final response
         if response:
@@ -94,36 +134,42 @@ Generate only the function body code, no explanations or markdown."""
             if assistant_messages:
                 content = assistant_messages[-1].get('content', '')
                 
-                # Extract code from the response
-                if '```python' in content:
-                    # Extract code from markdown
-                    start = content.find('```python') + 9
-                    end = content.find('```', start)
-                    if end > start:
-                        code = content[start:end].strip()
-                    else:
-                        code = content[start:].strip()
-                else:
-                    # Use content directly
-                    code = content
+                # Extract code from a markdown fence (unclosed fences run to the end)
+                match = _CODE_FENCE.search(content)
+                code = match.group(1).strip() if match else content
                 
                 # Estimate token usage (since Qwen-Agent doesn't provide exact counts)
-                estimated_input = len(agent_prompt.split()) * 1.3
-                estimated_output = len(code.split()) * 1.3
+                estimated_input = _input_tokens(prompt)
+                estimated_output = estimate_tokens(code, MODEL)
                 
-                token_usage["input_tokens"] += int(estimated_input)
-                token_usage["output_tokens"] += int(estimated_output)
-                token_usage["total_tokens"] += int(estimated_input + estimated_output)
+                token_usage.add(estimated_input, estimated_output)
                 
                 return sanitize_completion(code)
         
-        return "    pass  # No response generated"
+        return EMPTY_COMPLETION
         
     except Exception as e:
         print(f"❌ Qwen-Agent error: {e}")
-        return "    pass  # Error generating completion"
+        return ERROR_COMPLETION
+
+@cached_completion("qwen_agent", MODEL, TEMPERATURE, token_usage, _SYSTEM_PROMPT, _PROMPT_TEMPLATE)
+async def agenerate_one_completion(prompt: str) -> str:
+    """
+    Async variant of generate_one_completion.
+    Qwen-Agent has no async API, so the blocking call runs in a worker thread.
+    """
+    return await asyncio.to_thread(generate_one_completion.__wrapped__, prompt)
+
+async def generate_many_completions(prompts: list, max_concurrency: int = 16) -> list:
+    """Complete many prompts concurrently, at most max_concurrency requests in flight."""
+    return await gather_completions(agenerate_one_completion, prompts, max_concurrency)
+
+def generate_many_completions_sync(prompts: list, max_concurrency: int = 16) -> list:
+    """Blocking wrapper around generate_many_completions (see llm_clients.run_sync)."""
+    return run_sync(generate_many_completions(prompts, max_concurrency))
 
 def reset_agent():
     """Reset singleton instances."""
     global _agent_instance
     _agent_instance = None
+    close_clients()
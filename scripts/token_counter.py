@@ -0,0 +1,107 @@
+# token_counter.py
+"""
+Thread-safe token usage totals shared by the backends.
+
+Completions are generated concurrently (asyncio tasks, worker threads for
+blocking frameworks), so counters are updated under a lock instead of with
+unsynchronized `dict[key] += n`.
+
+Backends whose frameworks do not report usage estimate it with
+estimate_tokens(): an exact tiktoken count when tiktoken is installed,
+otherwise the usual ~4 characters per token heuristic.
+"""
+
+import contextlib
+import contextvars
+import functools
+import threading
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# [input, output] tally of the call running in this context, see record_call()
+_call_usage = contextvars.ContextVar("call_usage", default=None)
+
+
+class TokenCounter:
+    """
+    Input/output token totals guarded by a single lock. cached_tokens counts
+    the input tokens the API served from its prompt cache (where reported).
+    """
+
+    __slots__ = ("_lock", "input_tokens", "output_tokens", "cached_tokens")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cached_tokens = 0
+
+    def add(self, input_tokens: int, output_tokens: int, cached_tokens: int = 0):
+        """Add one request's token counts."""
+        with self._lock:
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+            self.cached_tokens += cached_tokens
+        tally = _call_usage.get()
+        if tally is not None:
+            tally[0] += input_tokens
+            tally[1] += output_tokens
+
+    def snapshot(self) -> dict:
+        """Consistent copy of the totals in the get_token_usage() format."""
+        with self._lock:
+            return {
+                "input_tokens": self.input_tokens,
+                "output_tokens": self.output_tokens,
+                "total_tokens": self.input_tokens + self.output_tokens,
+                "cached_tokens": self.cached_tokens,
+            }
+
+    def reset(self):
+        """Zero all counters."""
+        with self._lock:
+            self.input_tokens = 0
+            self.output_tokens = 0
+            self.cached_tokens = 0
+
+
+@contextlib.contextmanager
+def record_call():
+    """
+    Collect the tokens any TokenCounter.add()s during the block into an
+    [input, output] list. Context-local, so concurrent tasks (and worker
+    threads started with asyncio.to_thread) each see only their own call.
+    """
+    tally = [0, 0]
+    token = _call_usage.set(tally)
+    try:
+        yield tally
+    finally:
+        _call_usage.reset(token)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_encoding(model: str):
+    """tiktoken encoding for model (None without tiktoken)."""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+@functools.lru_cache(maxsize=2048)
+def estimate_tokens(text: str, model: str = "gpt-4o") -> int:
+    """
+    Token count of text for model. Cached because the same prompts are
+    counted once per sample.
+    """
+    encoding = _get_encoding(model)
+    if encoding is None:
+        # Round up so short non-empty strings never count as zero tokens
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))